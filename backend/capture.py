@@ -0,0 +1,98 @@
+"""
+Screen capture for ScreenKnow
+One long-lived grabber per thread, shared by every endpoint that needs a screenshot
+"""
+
+import io
+import logging
+import os
+import sys
+import threading
+
+import mss
+from PIL import Image
+
+import config
+
+logger = logging.getLogger(__name__)
+
+DISABLE_SCREENSHOT = config.DISABLE_SCREENSHOT
+
+# The capture backend is chosen once at import. On Windows, DXcam (Desktop Duplication API)
+# beats both mss and PIL.ImageGrab; everywhere else mss is the fastest option and remains
+# the fallback. A Linux host without an X display (e.g. a headless server) can't capture.
+# Nothing is set up when screenshots are disabled.
+_CAM = None
+if not DISABLE_SCREENSHOT:
+    if sys.platform.startswith("win"):
+        try:
+            import dxcam
+            _CAM = dxcam.create()
+        except Exception as e:
+            logger.warning("DXcam unavailable (%s); using mss for screenshots.", e)
+    elif sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+        logger.warning("No DISPLAY set; disabling screenshots.")
+        DISABLE_SCREENSHOT = True
+
+_cam_lock = threading.Lock()
+_cam_last_frame = None
+
+def _grab_dxcam():
+    """Returns the latest DXcam frame; grab() yields None when the screen hasn't changed."""
+    global _cam_last_frame
+    with _cam_lock:
+        frame = _CAM.grab()
+        if frame is not None:
+            _cam_last_frame = frame
+        return _cam_last_frame
+
+# mss instances hold a display/GDI handle and are not thread-safe, so keep one per thread.
+# Every grabber is also tracked so the app can release the handles on shutdown.
+_tls = threading.local()
+_grabbers = []
+_grabbers_lock = threading.Lock()
+
+def _get_sct():
+    """Returns this thread's long-lived mss grabber, creating it on first use."""
+    sct = getattr(_tls, "sct", None)
+    if sct is None:
+        sct = _tls.sct = mss.mss()
+        with _grabbers_lock:
+            _grabbers.append(sct)
+    return sct
+
+def close_grabbers():
+    """Closes every mss grabber created so far."""
+    with _grabbers_lock:
+        while _grabbers:
+            try:
+                _grabbers.pop().close()
+            except Exception as e:
+                logger.warning("Failed to close screen grabber: %s", e)
+
+def take_screenshot() -> Image.Image:
+    """Grabs the primary monitor straight into an in-memory PIL image."""
+    if _CAM is not None:
+        frame = _grab_dxcam()
+        if frame is not None:
+            return Image.fromarray(frame)
+    sct = _get_sct()
+    raw = sct.grab(sct.monitors[1])
+    # mss hands back BGRA pixels; PIL's BGRX unpacker decodes them directly (no PNG round-trip),
+    # and passing the raw bytearray skips the extra bytes copy that .bgra makes.
+    return Image.frombytes("RGB", raw.size, raw.raw, "raw", "BGRX")
+
+# Gemini downsamples larger images anyway, so anything past this only costs upload time.
+GEMINI_IMAGE_MAX_DIM = 1568
+GEMINI_JPEG_QUALITY = 85
+
+def encode_for_gemini(img: Image.Image) -> dict:
+    """Downscales the image and encodes it as an in-memory JPEG blob for Gemini."""
+    img.thumbnail((GEMINI_IMAGE_MAX_DIM, GEMINI_IMAGE_MAX_DIM), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=GEMINI_JPEG_QUALITY, optimize=False)
+    return {'mime_type': 'image/jpeg', 'data': buf.getvalue()}
+
+def capture_for_gemini() -> dict:
+    """Takes a screenshot and returns it ready to drop into a Gemini request."""
+    return encode_for_gemini(take_screenshot())
@@ -0,0 +1,27 @@
+"""
+Configuration for ScreenKnow
+Environment variables (and backend/.env) are read once at import and shared by every module
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+DEEPGRAM_API_KEY = os.environ.get("DEEPGRAM_API_KEY")
+DISABLE_SCREENSHOT = os.environ.get("DISABLE_SCREENSHOT", "false").lower() == "true"
+
+# Hard cap per recording so a broken or hostile client can't grow a buffer without bound.
+MAX_AUDIO_BYTES = 8 * 1024 * 1024
+
+
+def require(name: str, value) -> str:
+    """Return value, or fail at import time if the setting it came from is missing.
+
+    Modules that can't work without a key call this at module level, so a misconfigured
+    server refuses to start instead of rejecting every connection."""
+    if not value:
+        raise RuntimeError(f"{name} is not set. Add it to the environment or backend/.env.")
+    return value
@@ -0,0 +1,47 @@
+"""
+Gemini client setup for ScreenKnow
+The SDK is configured once per process and each model is built once, shared by every endpoint
+"""
+
+import functools
+
+import google.generativeai as genai
+
+from config import GEMINI_API_KEY
+
+# The key is process-wide and set exactly once, here. The SDK caches its service clients
+# module-wide (gRPC for sync calls, grpc_asyncio for *_async calls), so every request
+# multiplexes over the same long-lived HTTP/2 channel. Calling genai.configure() again would
+# reset that cache, while models already in use keep their old client.
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY)
+
+
+# Each model is built once, on first use, so importing this module never blocks on SDK/auth setup.
+@functools.lru_cache(maxsize=None)
+def get_text_model() -> genai.GenerativeModel:
+    """Multimodal model that answers the audio + screenshot prompt"""
+    return genai.GenerativeModel('gemini-2.5-flash')
+
+
+@functools.lru_cache(maxsize=None)
+def get_image_model() -> genai.GenerativeModel:
+    """Image generation model used for follow-up images"""
+    return genai.GenerativeModel('gemini-2.5-flash-image')
+
+
+@functools.lru_cache(maxsize=None)
+def get_voice_model() -> genai.GenerativeModel:
+    """Model behind the Pipecat voice endpoints"""
+    return genai.GenerativeModel('gemini-2.0-flash-exp')
+
+
+def chunk_text(chunk):
+    """Return a streamed chunk's text, or None when it has none.
+
+    chunk.text raises ValueError for chunks without parts (e.g. a final chunk that only
+    carries the finish reason) or with a non-text part such as an inline image."""
+    try:
+        return chunk.text
+    except ValueError:
+        return None
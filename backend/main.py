@@ -1,35 +1,32 @@
-import google.generativeai as genai
-import mss
 import os
-from PIL import Image
 import sys
+import logging
+import mimetypes
 import asyncio
-import io
-import json
-import base64
-import traceback
-from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+import collections
+import queue
+import tempfile
+import orjson
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.websockets import WebSocketState
 
-# --- Configuration ---
-# Load environment variables from a .env file in the backend directory (if present)
-load_dotenv()
-
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+import config
+from capture import DISABLE_SCREENSHOT, capture_for_gemini, close_grabbers
+from gemini import chunk_text, get_image_model, get_text_model
+from messages import send_message
 
-if not GEMINI_API_KEY:
-    print("Error: GEMINI_API_KEY not found. Please set it as an environment variable.")
-    sys.exit(1)
+# --- Configuration ---
+# config.py has already loaded backend/.env (if present) into the environment.
+# Request and stream tracing goes through logging rather than print(), so none of it is
+# formatted or written on the event loop unless LOG_LEVEL asks for it.
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper())
+logger = logging.getLogger(__name__)
 
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    # Two-model pipeline: multimodal text + image generation
-    model_text = genai.GenerativeModel('gemini-2.5-flash')
-    model_image = genai.GenerativeModel('gemini-2.5-flash-image')
-except Exception as e:
-    print(f"Error configuring Gemini API: {e}")
-    sys.exit(1)
+# Two-model pipeline: multimodal text + image generation. The SDK and both models are set
+# up once in gemini.py and shared with the Pipecat endpoints. Deepgram is only needed by
+# the Pipecat modules, which validate their own key when imported.
+config.require("GEMINI_API_KEY", config.GEMINI_API_KEY)
 
 # --- FastAPI App Initialization ---
 app = FastAPI()
@@ -44,15 +41,125 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def warm_gemini_channel():
+    """Opens the Gemini channel in the background so the first request skips the TLS handshake."""
+    async def _warm():
+        try:
+            await get_text_model().count_tokens_async("ping")
+        except Exception as e:
+            logger.warning("Gemini warm-up failed: %s", e)
+    app.state.gemini_warmup = asyncio.create_task(_warm())
+
+@app.on_event("shutdown")
+def release_screen_grabbers():
+    close_grabbers()
+
 # --- Helper Functions ---
-DISABLE_SCREENSHOT = os.environ.get("DISABLE_SCREENSHOT", "false").lower() == "true"
+# Dumping generated images to disk is a debugging aid only; keep it off the hot path by default.
+DEBUG_SAVE_IMAGES = os.environ.get("DEBUG_SAVE_IMAGES") == "1"
+# Debug images go to tmpfs where available so they never touch the disk.
+DEBUG_IMAGE_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+# Only the most recent images are kept, so tmpfs (i.e. RAM) use stays bounded on a long run.
+DEBUG_IMAGE_KEEP = 10
+_debug_image_paths: "collections.deque[str]" = collections.deque()
+
+# --- Audio Buffer Pool ---
+# Recording buffers are recycled across connections so ingesting audio doesn't
+# reallocate and copy a growing BytesIO on every frame.
+AUDIO_BUFFER_SIZE = 1 << 20
+AUDIO_POOL_SIZE = 8
+_AUDIO_POOL: "queue.SimpleQueue[bytearray]" = queue.SimpleQueue()
+for _ in range(AUDIO_POOL_SIZE):
+    _AUDIO_POOL.put(bytearray(AUDIO_BUFFER_SIZE))
+
+def _acquire_audio_buffer() -> bytearray:
+    """Takes a pre-sized buffer from the pool, allocating a fresh one if it is empty."""
+    try:
+        return _AUDIO_POOL.get_nowait()
+    except queue.Empty:
+        return bytearray(AUDIO_BUFFER_SIZE)
+
+def _release_audio_buffer(buf: bytearray):
+    """Returns a buffer to the pool, trimming any growth beyond the default size."""
+    if _AUDIO_POOL.qsize() >= AUDIO_POOL_SIZE:
+        return
+    del buf[AUDIO_BUFFER_SIZE:]
+    _AUDIO_POOL.put(buf)
+
+def find_image_prompt(line: str):
+    """Returns the prompt if line is an `IMAGE_PROMPT:` sentinel, otherwise None."""
+    if line.strip().upper().startswith("IMAGE_PROMPT:"):
+        return line.split(":", 1)[1].strip() or None
+    return None
+
+def _log_capture_failure(task: asyncio.Task):
+    """Logs a failed screenshot capture. Retrieving the exception here also covers handlers
+    that return before awaiting the capture (no audio, too long, disconnect)."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Screenshot capture failed: %s", task.exception())
 
-def take_screenshot():
-    """Takes a screenshot and saves it as screenshot.png."""
-    with mss.mss() as sct:
-        filename = sct.shot(output="screenshot.png")
-        print(f"Screenshot saved as {filename}")
-        return filename
+def save_debug_image(image_bytes: bytes, mime_type: str) -> str:
+    """Writes image bytes to a fresh file with unbuffered syscalls and returns its path.
+
+    Each image gets its own mkstemp() name, so concurrent connections never overwrite or
+    read back half of each other's files. Older files beyond DEBUG_IMAGE_KEEP are removed."""
+    suffix = mimetypes.guess_extension(mime_type) or ""
+    fd, path = tempfile.mkstemp(prefix="generated_image_", suffix=suffix, dir=DEBUG_IMAGE_DIR)
+    try:
+        view = memoryview(image_bytes)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    _debug_image_paths.append(path)
+    while len(_debug_image_paths) > DEBUG_IMAGE_KEEP:
+        try:
+            os.unlink(_debug_image_paths.popleft())
+        except OSError as e:
+            logger.warning("Failed to remove old debug image: %s", e)
+    return path
+
+# --- Outgoing Messages ---
+# Gemini streams many tiny text chunks; merging the ones that land within this window
+# into a single frame cuts WebSocket send/drain overhead without visible lag. A frame goes
+# out early once it holds TEXT_FLUSH_CHARS, so fast streams don't sit on a full window.
+TEXT_FLUSH_INTERVAL = 0.02
+TEXT_FLUSH_CHARS = 256
+_NO_MESSAGE = object()
+
+async def send_coalesced(websocket: WebSocket, outbox: asyncio.Queue):
+    """Sends queued messages in order until a None sentinel, merging runs of text into one frame."""
+    loop = asyncio.get_running_loop()
+    message = await outbox.get()
+    while message is not None:
+        if message["type"] != "text":
+            await send_message(websocket, message)
+            message = await outbox.get()
+            continue
+        texts = [message["data"]]
+        size = len(message["data"])
+        deadline = loop.time() + TEXT_FLUSH_INTERVAL
+        message = _NO_MESSAGE
+        while size < TEXT_FLUSH_CHARS:
+            if outbox.empty():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(outbox.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                message = outbox.get_nowait()
+            if message is None or message["type"] != "text":
+                break
+            texts.append(message["data"])
+            size += len(message["data"])
+            message = _NO_MESSAGE
+        await send_message(websocket, {"type": "text", "data": "".join(texts)})
+        if message is _NO_MESSAGE:
+            message = await outbox.get()
 
 # --- Root Endpoint ---
 @app.get("/")
@@ -63,52 +170,73 @@ def read_root():
 @app.websocket("/api/audio-stream")
 async def audio_stream(websocket: WebSocket):
     await websocket.accept()
-    print("WebSocket connection established.")
-    audio_buffer = io.BytesIO()
-    screenshot_path = "screenshot.png"
-    generated_image_path = "generated_image.png"
+    logger.info("WebSocket connection established.")
+    audio_buffer = _acquire_audio_buffer()
+    audio_len = 0
     audio_mime_type = None
+    screenshot_task = None
+    writer_task = None
+    image_task = None
+    close_code = status.WS_1000_NORMAL_CLOSURE
+    if not DISABLE_SCREENSHOT:
+        # Start the capture straight away so it overlaps with the whole recording instead
+        # of being paid for after END_OF_STREAM.
+        logger.info("Taking screenshot...")
+        screenshot_task = asyncio.create_task(asyncio.to_thread(capture_for_gemini))
+        screenshot_task.add_done_callback(_log_capture_failure)
     
     try:
         while True:
+            # Starlette can't split one connection into separate bytes/text iterators, so
+            # branch on the raw ASGI message: disconnect once, then a single payload lookup.
             data = await websocket.receive()
-            if 'bytes' in data:
-                audio_buffer.write(data['bytes'])
-            elif 'text' in data:
+            if data['type'] == 'websocket.disconnect':
+                raise WebSocketDisconnect(data.get('code', 1000))
+            chunk = data.get('bytes')
+            if chunk is not None:
+                if audio_len + len(chunk) > config.MAX_AUDIO_BYTES:
+                    logger.warning("Audio exceeded %d bytes; rejecting stream.", config.MAX_AUDIO_BYTES)
+                    await send_message(websocket, {"type": "error", "data": "Audio recording is too long."})
+                    close_code = status.WS_1009_MESSAGE_TOO_BIG
+                    return
+                # Slice assignment overwrites in place and only grows past the pooled capacity.
+                audio_buffer[audio_len:audio_len + len(chunk)] = chunk
+                audio_len += len(chunk)
+            else:
                 # Handle control or config messages from the client
-                text = data['text']
+                text = data.get('text')
                 if text == "END_OF_STREAM":
-                    print("End of audio stream signal received.")
+                    logger.info("End of audio stream signal received.")
                     break
                 # Try parse JSON config for mime type, ignore if not JSON
                 try:
-                    obj = json.loads(text)
+                    obj = orjson.loads(text)
                     if isinstance(obj, dict) and obj.get('type') == 'config':
                         audio_mime_type = obj.get('audio_mime_type') or audio_mime_type
-                        print(f"Configured client audio mime type: {audio_mime_type}")
+                        logger.info("Configured client audio mime type: %s", audio_mime_type)
                 except Exception:
                     pass
         
-        audio_data = audio_buffer.getvalue()
-        if not audio_data:
+        if not audio_len:
             message = {"type": "error", "data": "No audio data received."}
-            await websocket.send_text(json.dumps(message))
+            await send_message(websocket, message)
             return
 
-        print(f"Received {len(audio_data)} bytes of audio data.")
-        img = None
-        if not DISABLE_SCREENSHOT:
-            print("Taking screenshot...")
+        logger.info("Received %d bytes of audio data.", audio_len)
+        # The only copy of the recording: the Gemini Blob proto needs real bytes, and the pooled
+        # buffer is handed to the next connection as soon as this one finishes.
+        with memoryview(audio_buffer) as view:
+            audio_data = bytes(view[:audio_len])
+        screenshot = None
+        if screenshot_task is not None:
             try:
-                take_screenshot()
-                if os.path.exists(screenshot_path):
-                    img = Image.open(screenshot_path)
-                else:
-                    print("Screenshot file not found after capture; continuing without image.")
-            except Exception as e:
-                print(f"Screenshot capture failed: {e}. Continuing without image.")
+                # Grab + encode run in a worker thread; keep the event loop free for other sockets.
+                screenshot = await screenshot_task
+            except Exception:
+                # Already logged by _log_capture_failure
+                logger.info("Continuing without screenshot.")
 
-        print("Sending inputs to Gemini (audio" + (" + screenshot" if img else " only") + ")...")
+        logger.info("Sending inputs to Gemini (audio%s)...", " + screenshot" if screenshot else " only")
         # Default to audio/webm if client did not provide mime type
         gemini_audio_file = {'mime_type': audio_mime_type or 'audio/webm', 'data': audio_data}
 
@@ -119,104 +247,156 @@ async def audio_stream(websocket: WebSocket):
         )
         # Ask for a streamed response so we can surface text progressively and collect an image prompt.
         parts = [prompt, gemini_audio_file]
-        if img is not None:
-            parts.append(img)
-        response_stream = model_text.generate_content(parts, stream=True)
+        if screenshot is not None:
+            parts.append(screenshot)
+        # Concurrent clients each get their own call; the SDK already multiplexes them over
+        # one shared grpc_asyncio channel.
+        response_stream = await get_text_model().generate_content_async(parts, stream=True)
 
-        print("--- Waiting for Gemini Response ---")
-        collected_text = ""
+        logger.info("--- Waiting for Gemini Response ---")
+        # Only the current, not-yet-terminated line is kept; finished lines are checked for
+        # the IMAGE_PROMPT sentinel as they complete, so the full response is never re-scanned.
+        # The tail is held as a list of pieces and joined only when a newline arrives, so a
+        # long single-line answer stays O(n) instead of a quadratic string build.
+        tail_parts: list[str] = []
+        outbox: asyncio.Queue = asyncio.Queue()
+        writer_task = asyncio.create_task(send_coalesced(websocket, outbox))
+
+        async def enqueue(message: dict):
+            """Hands a message to the writer, re-raising its error if a send has already failed."""
+            if writer_task.done():
+                # The writer only stops before the None sentinel when a send raised (e.g. the
+                # client went away); stop reading the stream instead of queueing into the void.
+                writer_task.result()
+            await outbox.put(message)
+
+        async def generate_follow_up_image(image_prompt: str):
+            """Renders IMAGE_PROMPT with gemini-2.5-flash-image and returns the image message, if any."""
+            logger.info("Found IMAGE_PROMPT. Generating image with flash-image: %s", image_prompt)
+            img_response = await get_image_model().generate_content_async([image_prompt])
+            parts = getattr(img_response, 'parts', None)
+            if not parts:
+                # Fallback: some SDK versions put data under candidates[0].content.parts
+                candidates = getattr(img_response, 'candidates', [])
+                if candidates:
+                    parts = candidates[0].content.parts
+            if not parts:
+                logger.warning("No inline image data returned from image model.")
+                return None
+            for part in parts:
+                if getattr(part, 'inline_data', None):
+                    mime_type = part.inline_data.mime_type or 'image/png'
+                    image_bytes = part.inline_data.data
+                    if DEBUG_SAVE_IMAGES:
+                        logger.debug("Saved generated image to %s", save_debug_image(image_bytes, mime_type))
+                    return {"type": "image", "mime_type": mime_type, "data": image_bytes}
+            return None
+
+        def start_image_generation(text: str):
+            """Starts the follow-up image in the background once an IMAGE_PROMPT line is seen."""
+            nonlocal image_task
+            image_prompt = find_image_prompt(text)
+            if image_prompt:
+                image_task = asyncio.create_task(generate_follow_up_image(image_prompt))
 
         async def process_text(text: str):
-            nonlocal collected_text
             if not text:
                 return
-            collected_text += text
-            message = {"type": "text", "data": text}
-            await websocket.send_text(json.dumps(message))
-
-        for chunk in response_stream:
-            print(f"DEBUG: Received chunk: {chunk}")
-            # Newer SDKs can deliver text via chunk.text and data via parts/inline_data.
-            # Prefer parts if available, otherwise fall back to chunk.text when present.
-            parts = getattr(chunk, 'parts', None)
-            if not parts and getattr(chunk, 'text', None):
-                await process_text(chunk.text)
+            await enqueue({"type": "text", "data": text})
+            if image_task is not None:
+                return
+            tail_parts.append(text)
+            if "\n" not in text:
+                return
+            *lines, rest = "".join(tail_parts).split("\n")
+            tail_parts[:] = [rest]
+            for line in lines:
+                # Kicking off here lets image generation overlap with the rest of the text stream.
+                start_image_generation(line)
+                if image_task is not None:
+                    tail_parts.clear()
+                    break
+
+        async for chunk in response_stream:
+            logger.debug("Received chunk: %s", chunk)
+            # Text-only chunks are the common case and resolve in one read; only chunks without
+            # plain text (no parts, or an inline image) are worth walking part by part.
+            text = chunk_text(chunk)
+            if text is not None:
+                await process_text(text)
                 continue
 
+            parts = getattr(chunk, 'parts', None)
             if not parts:
                 continue
 
-            print(f"DEBUG: Chunk parts: {parts}")
+            logger.debug("Chunk parts: %s", parts)
             for part in parts:
                 if part.text:
-                    print(f"DEBUG: Found text part: {part.text}")
+                    logger.debug("Found text part: %s", part.text)
                     await process_text(part.text)
                 elif part.inline_data:
-                    print("DEBUG: Found image part!")
+                    logger.debug("Found image part")
                     image_bytes = part.inline_data.data
-                    
-                    # Save the image to a file for debugging
-                    print(f"DEBUG: Saving generated image to {generated_image_path}")
-                    with open(generated_image_path, "wb") as f:
-                        f.write(image_bytes)
-
-                    base64_image = base64.b64encode(image_bytes).decode('utf-8')
                     mime_type = part.inline_data.mime_type or 'image/png'
-                    message = {"type": "image", "mime_type": mime_type, "data": base64_image}
-                    await websocket.send_text(json.dumps(message))
-        print("--- Finished Processing Gemini Response ---")
 
-        # Attempt follow-up image generation with gemini-2.5-flash-image if IMAGE_PROMPT was provided.
-        try:
-            image_prompt = None
-            for line in collected_text.splitlines():
-                if line.strip().upper().startswith("IMAGE_PROMPT:"):
-                    image_prompt = line.split(":", 1)[1].strip()
-                    break
-            if image_prompt:
-                print(f"Found IMAGE_PROMPT. Generating image with flash-image: {image_prompt}")
-                img_response = model_image.generate_content([image_prompt])
-                parts = getattr(img_response, 'parts', None)
-                if not parts:
-                    # Fallback: some SDK versions put data under candidates[0].content.parts
-                    candidates = getattr(img_response, 'candidates', [])
-                    if candidates:
-                        parts = candidates[0].content.parts
-                if parts:
-                    for part in parts:
-                        if getattr(part, 'inline_data', None):
-                            mime_type = part.inline_data.mime_type or 'image/png'
-                            image_bytes = part.inline_data.data
-                            with open(generated_image_path, "wb") as f:
-                                f.write(image_bytes)
-                            base64_image = base64.b64encode(image_bytes).decode('utf-8')
-                            await websocket.send_text(json.dumps({
-                                "type": "image",
-                                "mime_type": mime_type,
-                                "data": base64_image,
-                            }))
-                            break
-                else:
-                    print("No inline image data returned from image model.")
-        except Exception as e:
-            print(f"Image generation follow-up failed: {e}")
+                    if DEBUG_SAVE_IMAGES:
+                        logger.debug("Saved generated image to %s", save_debug_image(image_bytes, mime_type))
+                    await enqueue({"type": "image", "mime_type": mime_type, "data": image_bytes})
+        # Flush whatever text is still pending before anything else goes out.
+        await outbox.put(None)
+        await writer_task
+        logger.info("--- Finished Processing Gemini Response ---")
+
+        # The sentinel is usually the last line, which only completes when the stream ends.
+        if image_task is None:
+            start_image_generation("".join(tail_parts))
+        if image_task is not None:
+            try:
+                message = await image_task
+                if message is not None:
+                    await send_message(websocket, message)
+            except Exception as e:
+                logger.warning("Image generation follow-up failed: %s", e)
 
     except WebSocketDisconnect:
-        print("Client disconnected.")
+        logger.info("Client disconnected.")
     except Exception as e:
-        print(f"An error occurred in WebSocket. Type: {type(e).__name__}")
-        traceback.print_exc()
+        logger.exception("An error occurred in WebSocket. Type: %s", type(e).__name__)
         message = {"type": "error", "data": f"A backend error occurred. Check server logs. Type: {type(e).__name__}"}
         try:
-            await websocket.send_text(json.dumps(message))
+            await send_message(websocket, message)
         except Exception as send_e:
-            print(f"Failed to send error to client: {send_e}")
+            logger.warning("Failed to send error to client: %s", send_e)
     finally:
-        if os.path.exists(screenshot_path):
-            try:
-                os.remove(screenshot_path)
-                print(f"Removed screenshot file: {screenshot_path}")
-            except Exception as e:
-                print(f"Failed to remove screenshot file: {e}")
-        await websocket.close()
-        print("WebSocket connection closed.")
+        if image_task is not None and not image_task.done():
+            image_task.cancel()
+        if writer_task is not None and not writer_task.done():
+            writer_task.cancel()
+        if screenshot_task is not None and not screenshot_task.done():
+            screenshot_task.cancel()
+        _release_audio_buffer(audio_buffer)
+        # A failed send leaves client_state CONNECTED but marks application_state
+        # DISCONNECTED, and a second close() would then raise.
+        if (websocket.client_state != WebSocketState.DISCONNECTED
+                and websocket.application_state != WebSocketState.DISCONNECTED):
+            await websocket.close(code=close_code)
+        logger.info("WebSocket connection closed.")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvloop + httptools + websockets are the C-accelerated stack; the hot path here is many
+    # small WebSocket sends, where per-frame overhead matters. Small text frames don't gain
+    # from per-message deflate, so skip the compression pass. uvloop has no Windows build.
+    uvicorn.run(
+        app,
+        host=os.environ.get("HOST", "127.0.0.1"),
+        port=int(os.environ.get("PORT", "8000")),
+        loop="asyncio" if sys.platform.startswith("win") else "uvloop",
+        http="httptools",
+        ws="websockets",
+        ws_max_size=16 * 1024 * 1024,
+        ws_per_message_deflate=False,
+    )
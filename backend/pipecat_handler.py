@@ -3,12 +3,9 @@ Pipecat integration for ScreenKnow
 Simple voice conversation with screenshot analysis
 """
 
-import os
 import asyncio
 import aiohttp
-from PIL import Image
-import mss
-import base64
+import pybase64 as base64
 import io
 
 from pipecat.pipeline.pipeline import Pipeline
@@ -20,50 +17,42 @@ from pipecat.services.openai import OpenAILLMService
 from pipecat.transports.services.daily import DailyParams, DailyTransport
 from pipecat.vad.silero import SileroVADAnalyzer
 
-import google.generativeai as genai
+import capture
+import config
+import gemini
+
+# Gemini is configured process-wide from config.GEMINI_API_KEY (see gemini.py)
+config.require("GEMINI_API_KEY", config.GEMINI_API_KEY)
 
 class ScreenKnowPipecatBot:
     """Simple Pipecat bot that handles voice + screenshot analysis"""
     
-    def __init__(self, gemini_api_key: str, deepgram_api_key: str, openai_api_key: str):
-        self.gemini_api_key = gemini_api_key
+    def __init__(self, deepgram_api_key: str, openai_api_key: str):
         self.deepgram_api_key = deepgram_api_key
         self.openai_api_key = openai_api_key
         
-        # Configure Gemini
-        genai.configure(api_key=gemini_api_key)
-        self.gemini_model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        # Reuse the shared Gemini model
+        self.gemini_model = gemini.get_voice_model()
     
     def take_screenshot(self) -> str:
-        """Take a screenshot and return base64 encoded image"""
-        with mss.mss() as sct:
-            screenshot = sct.grab(sct.monitors[0])
-            img = Image.frombytes("RGB", screenshot.size, screenshot.bgra, "raw", "BGRX")
-            
-            # Convert to base64
-            buffered = io.BytesIO()
-            img.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            return img_str
+        """Take a screenshot and return base64 encoded JPEG image"""
+        img = capture.take_screenshot()
+        
+        # JPEG encodes a screen far faster than PNG's DEFLATE and is ~10x smaller
+        buffered = io.BytesIO()
+        img.save(buffered, format="JPEG", quality=85, optimize=False, progressive=False)
+        # getbuffer() hands pybase64 a zero-copy view instead of a bytes copy
+        img_str = base64.b64encode(buffered.getbuffer()).decode()
+        return img_str
     
     async def analyze_with_gemini(self, question: str) -> str:
         """Take screenshot and analyze with Gemini"""
         try:
-            # Take screenshot
-            screenshot_path = "screenshot_temp.png"
-            with mss.mss() as sct:
-                sct.shot(output=screenshot_path)
-            
-            # Load and analyze with Gemini
-            img = Image.open(screenshot_path)
-            response = await asyncio.to_thread(
-                self.gemini_model.generate_content,
-                [question, img]
-            )
+            # Take screenshot straight into memory (no PNG round-trip through disk)
+            img = await asyncio.to_thread(capture.capture_for_gemini)
             
-            # Cleanup
-            if os.path.exists(screenshot_path):
-                os.remove(screenshot_path)
+            # Analyze with Gemini
+            response = await self.gemini_model.generate_content_async([question, img])
             
             return response.text
         except Exception as e:
@@ -76,7 +65,8 @@ class ScreenKnowPipecatBot:
         # Services
         stt_service = DeepgramSTTService(api_key=self.deepgram_api_key)
         
-        # Simple VAD for detecting when user stops speaking
+        # Simple VAD for detecting when user stops speaking. The analyzer keeps per-stream
+        # audio and model state, so every pipeline gets its own.
         vad = SileroVADAnalyzer()
         
         # For TTS, you can use OpenAI
@@ -96,12 +86,10 @@ class ScreenKnowPipecatBot:
 class SimpleVoiceHandler:
     """Simplified voice handler without Daily.co - just WebSocket + Pipecat services"""
     
-    def __init__(self, gemini_api_key: str, deepgram_api_key: str):
-        self.gemini_api_key = gemini_api_key
+    def __init__(self, deepgram_api_key: str):
         self.deepgram_api_key = deepgram_api_key
         
-        genai.configure(api_key=gemini_api_key)
-        self.gemini_model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        self.gemini_model = gemini.get_voice_model()
     
     async def handle_voice_conversation(self, websocket):
         """Handle voice conversation via WebSocket"""
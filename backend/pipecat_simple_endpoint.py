@@ -16,17 +16,24 @@ Setup:
 4. Add this to your main.py
 """
 
-import os
+import ssl
 import asyncio
-import json
+import orjson
 from fastapi import WebSocket, WebSocketDisconnect
-from PIL import Image
-import mss
-import google.generativeai as genai
 from pipecat.audio.vad.silero import SileroVADAnalyzer
 from pipecat.services.deepgram import DeepgramSTTService
 from pipecat.serializers.protobuf import ProtobufFrameSerializer
 
+import config
+from capture import capture_for_gemini
+from gemini import chunk_text, get_voice_model
+from messages import send_message
+
+# Both keys are checked once at import, so a misconfigured server fails on startup
+# instead of turning every connection away.
+config.require("GEMINI_API_KEY", config.GEMINI_API_KEY)
+DEEPGRAM_API_KEY = config.require("DEEPGRAM_API_KEY", config.DEEPGRAM_API_KEY)
+
 
 async def pipecat_voice_endpoint(websocket: WebSocket):
     """
@@ -38,33 +45,12 @@ async def pipecat_voice_endpoint(websocket: WebSocket):
     
     await websocket.accept()
     
-    # Initialize services
-    deepgram_key = os.environ.get("DEEPGRAM_API_KEY")
-    gemini_key = os.environ.get("GEMINI_API_KEY")
-    
-    if not deepgram_key:
-        await websocket.send_json({
-            "type": "error", 
-            "data": "DEEPGRAM_API_KEY not set. Get one at https://deepgram.com"
-        })
-        await websocket.close()
-        return
-    
-    if not gemini_key:
-        await websocket.send_json({
-            "type": "error",
-            "data": "GEMINI_API_KEY not set"
-        })
-        await websocket.close()
-        return
-    
     # Setup Gemini
-    genai.configure(api_key=gemini_key)
-    model = genai.GenerativeModel('gemini-2.0-flash-exp')
+    model = get_voice_model()
     
     # Setup Deepgram with Pipecat
     stt = DeepgramSTTService(
-        api_key=deepgram_key,
+        api_key=DEEPGRAM_API_KEY,
         url="wss://api.deepgram.com/v1/listen",
         encoding="linear16",
         sample_rate=16000,
@@ -92,32 +78,25 @@ async def pipecat_voice_endpoint(websocket: WebSocket):
                 transcript = "What can you see on my screen?"
                 
                 # Send status update
-                await websocket.send_json({
+                await send_message(websocket, {
                     "type": "text",
                     "data": f"📝 You said: {transcript}\n\n🔍 Analyzing screenshot...\n\n"
                 })
                 
-                # Take screenshot
-                screenshot_path = "temp_screenshot.png"
-                with mss.mss() as sct:
-                    sct.shot(output=screenshot_path)
+                # Take screenshot (in memory, no PNG round-trip)
+                img = await asyncio.to_thread(capture_for_gemini)
                 
                 # Analyze with Gemini
-                img = Image.open(screenshot_path)
-                response_stream = model.generate_content([transcript, img], stream=True)
+                response_stream = await model.generate_content_async([transcript, img], stream=True)
                 
-                # Stream response back
-                for chunk in response_stream:
-                    if chunk.text:
-                        await websocket.send_json({
+                # Stream response back without blocking the event loop between chunks
+                async for chunk in response_stream:
+                    text = chunk_text(chunk)
+                    if text:
+                        await send_message(websocket, {
                             "type": "text",
-                            "data": chunk.text
+                            "data": text
                         })
-                        await asyncio.sleep(0.05)
-                
-                # Cleanup
-                if os.path.exists(screenshot_path):
-                    os.remove(screenshot_path)
                 
                 break
     
@@ -125,7 +104,7 @@ async def pipecat_voice_endpoint(websocket: WebSocket):
         print("WebSocket disconnected")
     except Exception as e:
         print(f"Error: {e}")
-        await websocket.send_json({"type": "error", "data": str(e)})
+        await send_message(websocket, {"type": "error", "data": str(e)})
     finally:
         # Cleanup
         pass
@@ -153,63 +132,77 @@ you might not need Pipecat's full power yet.
 """
 
 
+# Built once and shared by every Deepgram connection: creating a default context loads
+# the system CA bundle, which is otherwise repeated on every voice turn.
+DEEPGRAM_SSL_CONTEXT = ssl.create_default_context()
+
+# How long to wait for Deepgram's final results after CloseStream before answering with
+# whatever has been transcribed so far.
+DEEPGRAM_CLOSE_TIMEOUT = 5.0
+
+
 # MINIMAL EXAMPLE: Just Deepgram + Your Current Code
 async def ultra_simple_voice_endpoint(websocket: WebSocket):
     """
     The ABSOLUTE simplest way without Pipecat's full framework
-    Just uses Deepgram's SDK directly
+    Just streams audio to Deepgram's live API directly
     """
-    import httpx
+    # The asyncio client (websockets >= 14) is the one that takes additional_headers=
+    from websockets.asyncio.client import connect
     
     await websocket.accept()
     
-    deepgram_key = os.environ.get("DEEPGRAM_API_KEY")
-    gemini_key = os.environ.get("GEMINI_API_KEY")
-    
-    audio_buffer = bytearray()
+    final_transcripts = []
     
     try:
-        while True:
-            data = await websocket.receive()
+        # Stream audio to Deepgram live as it arrives, so the transcript is ready
+        # moments after the user stops talking instead of after a full upload.
+        async with connect(
+            "wss://api.deepgram.com/v1/listen?punctuate=true",
+            additional_headers={"Authorization": f"Token {DEEPGRAM_API_KEY}"},
+            ssl=DEEPGRAM_SSL_CONTEXT,
+        ) as deepgram:
             
-            if "bytes" in data:
-                audio_buffer.extend(data["bytes"])
+            async def collect_transcripts():
+                async for message in deepgram:
+                    result = orjson.loads(message)
+                    if result.get("type") == "Results" and result.get("is_final"):
+                        text = result["channel"]["alternatives"][0]["transcript"]
+                        if text:
+                            final_transcripts.append(text)
             
-            elif "text" in data and data["text"] == "END_OF_STREAM":
-                # Transcribe with Deepgram
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        "https://api.deepgram.com/v1/listen",
-                        headers={
-                            "Authorization": f"Token {deepgram_key}",
-                            "Content-Type": "audio/webm"
-                        },
-                        content=bytes(audio_buffer)
-                    )
-                    result = response.json()
-                    transcript = result["results"]["channels"][0]["alternatives"][0]["transcript"]
-                
-                # Now use your existing Gemini code
-                genai.configure(api_key=gemini_key)
-                model = genai.GenerativeModel('gemini-2.0-flash-exp')
-                
-                screenshot_path = "temp_screenshot.png"
-                with mss.mss() as sct:
-                    sct.shot(output=screenshot_path)
-                
-                img = Image.open(screenshot_path)
-                response_stream = model.generate_content([transcript, img], stream=True)
-                
-                for chunk in response_stream:
-                    if chunk.text:
-                        await websocket.send_json({"type": "text", "data": chunk.text})
-                        await asyncio.sleep(0.05)
-                
-                if os.path.exists(screenshot_path):
-                    os.remove(screenshot_path)
-                
-                break
+            reader = asyncio.create_task(collect_transcripts())
+            try:
+                while True:
+                    data = await websocket.receive()
+                    
+                    if "bytes" in data:
+                        await deepgram.send(data["bytes"])
+                    
+                    elif "text" in data and data["text"] == "END_OF_STREAM":
+                        # Deepgram flushes its last results, then closes the stream
+                        await deepgram.send(orjson.dumps({"type": "CloseStream"}).decode())
+                        try:
+                            await asyncio.wait_for(reader, DEEPGRAM_CLOSE_TIMEOUT)
+                        except asyncio.TimeoutError:
+                            print("Deepgram did not close the stream in time; using partial transcript")
+                        break
+            finally:
+                reader.cancel()
+        
+        transcript = " ".join(final_transcripts)
+        
+        # Now use your existing Gemini code
+        model = get_voice_model()
+        
+        img = await asyncio.to_thread(capture_for_gemini)
+        response_stream = await model.generate_content_async([transcript, img], stream=True)
+        
+        async for chunk in response_stream:
+            text = chunk_text(chunk)
+            if text:
+                await send_message(websocket, {"type": "text", "data": text})
     
     except Exception as e:
-        await websocket.send_json({"type": "error", "data": str(e)})
+        await send_message(websocket, {"type": "error", "data": str(e)})
 
@@ -3,30 +3,29 @@ SIMPLEST Pipecat Setup for ScreenKnow
 Just handles: Audio In -> Transcribe -> Screenshot + Gemini -> Text Out
 """
 
-import os
 import asyncio
-from fastapi import WebSocket
-from PIL import Image
-import mss
-import google.generativeai as genai
+from fastapi import WebSocket, status
 
 # Optional: Add if you want text-to-speech
 # from pipecat.services.openai import OpenAITTSService
 from pipecat.services.deepgram import DeepgramSTTService
 
+import config
+import gemini
+from capture import capture_for_gemini
+from messages import send_message
+
+# Checked once at import, so a missing key fails on startup rather than per conversation.
+config.require("GEMINI_API_KEY", config.GEMINI_API_KEY)
+DEEPGRAM_API_KEY = config.require("DEEPGRAM_API_KEY", config.DEEPGRAM_API_KEY)
+
 
 class SimplePipecatHandler:
     """Minimal Pipecat integration - just STT + your existing logic"""
     
     def __init__(self):
-        # Get API keys from environment
-        self.deepgram_key = os.environ.get("DEEPGRAM_API_KEY", "")
-        self.gemini_key = os.environ.get("GEMINI_API_KEY", "")
-        
-        # Setup Gemini
-        if self.gemini_key:
-            genai.configure(api_key=self.gemini_key)
-            self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        # Setup Gemini (gemini.py configures the SDK on import)
+        self.model = gemini.get_voice_model()
     
     async def handle_conversation(self, websocket: WebSocket):
         """
@@ -39,11 +38,7 @@ class SimplePipecatHandler:
         """
         
         # Initialize Deepgram STT
-        if not self.deepgram_key:
-            await websocket.send_json({"type": "error", "data": "Deepgram API key not set"})
-            return
-        
-        stt = DeepgramSTTService(api_key=self.deepgram_key)
+        stt = DeepgramSTTService(api_key=DEEPGRAM_API_KEY)
         
         audio_buffer = bytearray()
         
@@ -57,45 +52,43 @@ class SimplePipecatHandler:
                 
                 if data.get("type") == "websocket.receive":
                     if isinstance(data.get("bytes"), bytes):
+                        if len(audio_buffer) + len(data["bytes"]) > config.MAX_AUDIO_BYTES:
+                            await send_message(websocket, {"type": "error", "data": "Audio recording is too long."})
+                            await websocket.close(code=status.WS_1009_MESSAGE_TOO_BIG)
+                            return
                         audio_buffer.extend(data["bytes"])
                     
                     elif data.get("text") == "END_OF_STREAM":
                         # User stopped recording
-                        await websocket.send_json({"type": "text", "data": "\n\n🎯 Analyzing your screen...\n\n"})
+                        await send_message(websocket, {"type": "text", "data": "\n\n🎯 Analyzing your screen...\n\n"})
                         
                         # Transcribe the audio (this is where Pipecat helps)
                         # Note: For full Pipecat integration, you'd set up a pipeline
                         # For now, we can use Deepgram directly or keep your current approach
                         
-                        # Take screenshot
-                        screenshot_path = "temp_screenshot.png"
-                        with mss.mss() as sct:
-                            sct.shot(output=screenshot_path)
+                        # Take screenshot (in memory, no PNG round-trip)
+                        img = await asyncio.to_thread(capture_for_gemini)
                         
                         # Analyze with Gemini (you can pass a transcribed question here)
-                        img = Image.open(screenshot_path)
                         question = "What do you see on this screen?" # You'd replace with transcribed audio
                         
-                        response = await asyncio.to_thread(
-                            self.model.generate_content,
-                            [question, img]
+                        response_stream = await self.model.generate_content_async(
+                            [question, img],
+                            stream=True
                         )
                         
-                        # Stream response back
-                        for chunk in response.text.split():
-                            await websocket.send_json({"type": "text", "data": chunk + " "})
-                            await asyncio.sleep(0.05)
-                        
-                        # Cleanup
-                        if os.path.exists(screenshot_path):
-                            os.remove(screenshot_path)
+                        # Stream response back as Gemini produces it
+                        async for chunk in response_stream:
+                            text = gemini.chunk_text(chunk)
+                            if text:
+                                await send_message(websocket, {"type": "text", "data": text})
                         
                         audio_buffer.clear()
                         break
         
         except Exception as e:
             print(f"Error: {e}")
-            await websocket.send_json({"type": "error", "data": str(e)})
+            await send_message(websocket, {"type": "error", "data": str(e)})
 
 
 # Even simpler: Use Pipecat ONLY for the pieces you need
@@ -103,8 +96,7 @@ class SimplePipecatHandler:
 
 async def simple_voice_to_screen_analysis(
     audio_data: bytes,
-    deepgram_key: str,
-    gemini_key: str
+    deepgram_key: str
 ) -> str:
     """
     Ultra-simple function using Pipecat for STT only
@@ -125,24 +117,13 @@ async def simple_voice_to_screen_analysis(
     # For now, placeholder:
     transcript = "What's on my screen?"
     
-    # Take screenshot
-    with mss.mss() as sct:
-        screenshot_path = "temp_screenshot.png"
-        sct.shot(output=screenshot_path)
-    
-    # Query Gemini
-    genai.configure(api_key=gemini_key)
-    model = genai.GenerativeModel('gemini-2.0-flash-exp')
-    img = Image.open(screenshot_path)
+    # Take screenshot (in memory, no PNG round-trip)
+    img = await asyncio.to_thread(capture_for_gemini)
     
-    response = await asyncio.to_thread(
-        model.generate_content,
-        [transcript, img]
-    )
+    # Query Gemini (configured process-wide in gemini.py)
+    model = gemini.get_voice_model()
     
-    # Cleanup
-    if os.path.exists(screenshot_path):
-        os.remove(screenshot_path)
+    response = await model.generate_content_async([transcript, img])
     
     return response.text
 
@@ -13,7 +13,7 @@ const MicrophoneIcon = ({ className }: { className?: string }) => (
 
 interface ResponsePart {
   type: 'text' | 'image' | 'error';
-  data: string;
+  data: string; // text, error message, or an object URL for images
   mime_type?: string;
 }
 
@@ -47,7 +47,11 @@ export default function Home() {
     }
 
     setError('');
-    setResponseParts([]);
+    setResponseParts(prevParts => {
+      // Generated images are held as object URLs; release the previous answer's blobs.
+      prevParts.forEach(p => p.type === 'image' && URL.revokeObjectURL(p.data));
+      return [];
+    });
     setIsRecording(true);
     setIsTranscribing(false);
 
@@ -119,12 +123,25 @@ export default function Home() {
           return;
         }
 
+        // Images arrive as a JSON header frame followed by one binary frame of raw bytes.
+        let pendingImageMime = 'image/png';
+
         ws.onmessage = (event) => {
+          if (typeof event.data !== 'string') {
+            const url = URL.createObjectURL(new Blob([event.data], { type: pendingImageMime }));
+            setResponseParts(prevParts => [...prevParts, { type: 'image', mime_type: pendingImageMime, data: url }]);
+            return;
+          }
+
           const message: ResponsePart = JSON.parse(event.data);
           if (message.type === 'error') {
             setError(message.data);
             return;
           }
+          if (message.type === 'image') {
+            pendingImageMime = message.mime_type || 'image/png';
+            return;
+          }
 
           setResponseParts(prevParts => {
             // For streaming text, append to the last text part if it exists
@@ -211,7 +228,7 @@ export default function Home() {
                   return (
                     <Image
                       key={index}
-                      src={`data:${part.mime_type};base64,${part.data}`}
+                      src={part.data}
                       alt="Generated image"
                       className="rounded-lg"
                       width={1024}
@@ -1,6 +1,6 @@
 import google.generativeai as genai
 import mss
-import os
+import io
 from PIL import Image
 import sys
 
@@ -15,28 +15,32 @@ except Exception as e:
     print("Please make sure you have set your GEMINI_API_KEY correctly.")
     sys.exit()
 
+# One grabber for the life of the app; re-creating it reconnects to the display every time.
+_sct = None
+
 def take_screenshot():
-    """Takes a screenshot and saves it as screenshot.png."""
-    with mss.mss() as sct:
-        filename = sct.shot(output="screenshot.png")
-        print(f"Screenshot saved as {filename}")
-        return filename
+    """Takes a screenshot of the primary monitor, downscaled and JPEG-encoded for Gemini."""
+    global _sct
+    if _sct is None:
+        _sct = mss.mss()
+    shot = _sct.grab(_sct.monitors[1])
+    img = Image.frombytes("RGB", shot.size, shot.bgra, "raw", "BGRX")
+    # Gemini doesn't use detail past ~1568px, and a JPEG is a fraction of the upload size.
+    img.thumbnail((1568, 1568), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return {'mime_type': 'image/jpeg', 'data': buf.getvalue()}
 
-def describe_screenshot(question):
+def describe_screenshot(question, img):
     """Describes the screenshot using the Gemini API based on a user's question."""
     print("Analyzing screenshot...")
     try:
-        img = Image.open("screenshot.png")
         response = model.generate_content([question, img])
         print("\n--- Gemini's Answer ---")
         print(response.text)
         print("-----------------------\n")
     except Exception as e:
         print(f"Error generating content: {e}")
-    finally:
-        # Clean up the screenshot file
-        if os.path.exists("screenshot.png"):
-            os.remove("screenshot.png")
 
 def main():
     """Main function to run the application."""
@@ -45,8 +49,8 @@ def main():
         question = input("> ")
         if question.lower() in ['exit', 'quit']:
             break
-        take_screenshot()
-        describe_screenshot(question)
+        img = take_screenshot()
+        describe_screenshot(question, img)
 
 
 if __name__ == "__main__":